@@ -4,12 +4,65 @@ KarooGlucometer Testing Suite - Consolidated Connection Tester
 Single tool for all connection and Bluetooth PAN testing
 """
 
+import asyncio
+import errno
+import selectors
 import socket
 import subprocess
 import json
 import time
 import requests
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+    load_json = orjson.loads  # Parses bytes directly
+except ImportError:
+    load_json = json.loads
+
+try:
+    import icmplib
+except ImportError:
+    icmplib = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import win32service
+    import win32serviceutil
+except ImportError:
+    win32serviceutil = None
+
+# connect_ex codes meaning a non-blocking connect is still in progress
+_CONNECT_PENDING = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+                    getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)}
+
+# Largest /sgv.json body we're willing to buffer from a misbehaving server
+MAX_RESPONSE_BYTES = 64 * 1024
+
+# getaddrinfo results keyed on (host, port), kept for 15 minutes
+_ADDRINFO_TTL = 900
+_addrinfo_cache = {}
+
+def _resolve(host, port):
+    """Cached TCP getaddrinfo lookup returning (family, type, proto, sockaddr)"""
+    key = (host, port)
+    now = time.monotonic()
+    cached = _addrinfo_cache.get(key)
+    if cached and now - cached[0] < _ADDRINFO_TTL:
+        return cached[1]
+    
+    family, socktype, proto, _, sockaddr = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM)[0]
+    result = (family, socktype, proto, sockaddr)
+    _addrinfo_cache[key] = (now, result)
+    return result
 
 class ConnectionTester:
     """Comprehensive connection testing for KarooGlucometer"""
@@ -18,29 +71,86 @@ class ConnectionTester:
         self.bluetooth_ips = ['192.168.44.1', '192.168.45.1', '192.168.46.1']
         self.port = 17580
         
+        # One pooled, keep-alive session shared by every xDrip probe
+        self.session = requests.Session()
+        self.session.headers['Connection'] = 'keep-alive'
+        adapter = HTTPAdapter(max_retries=Retry(total=1, backoff_factor=0.1),
+                              pool_connections=8, pool_maxsize=8)
+        self.session.mount('http://', adapter)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def close(self):
+        """Release pooled HTTP connections"""
+        self.session.close()
+        
     def test_socket_connection(self, ip, port=None):
         """Test basic socket connectivity"""
+        return self.test_socket_connection_many([ip], port)[ip]
+    
+    def test_socket_connection_many(self, ips, port=None, timeout=3):
+        """Connect to several IPs at once on one selector, returning {ip: connected}"""
         if port is None:
             port = self.port
-            
+        
+        results = dict.fromkeys(ips, False)
+        selector = selectors.DefaultSelector()
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(3)
-            result = sock.connect_ex((ip, port))
-            sock.close()
-            return result == 0
-        except Exception:
-            return False
+            # Start every non-blocking connect, then wait on all of them together
+            for ip in ips:
+                sock = None
+                try:
+                    family, socktype, proto, sockaddr = _resolve(ip, port)
+                    sock = socket.socket(family, socktype, proto)
+                    sock.setblocking(False)
+                    error = sock.connect_ex(sockaddr)
+                    if error in _CONNECT_PENDING:
+                        selector.register(sock, selectors.EVENT_WRITE, ip)
+                        continue
+                    # Connected or failed outright (no route, refused, ...)
+                    results[ip] = error == 0
+                    sock.close()
+                except OSError:
+                    if sock is not None:
+                        sock.close()
+            
+            deadline = time.monotonic() + timeout
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in selector.select(remaining):
+                    error = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    results[key.data] = error == 0
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+        finally:
+            # Anything still registered timed out
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+        
+        return results
     
     def test_xdrip_service(self, ip):
         """Test xDrip web service"""
         try:
-            response = requests.get(f"http://{ip}:{self.port}/sgv.json", timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                return True, data
-            else:
-                return False, f"HTTP {response.status_code}"
+            response = self.session.get(f"http://{ip}:{self.port}/sgv.json", timeout=5, stream=True)
+            try:
+                if response.status_code != 200:
+                    return False, f"HTTP {response.status_code}"
+                body = self._read_body(response)
+            finally:
+                response.close()
+            
+            # Skip the JSON decoder for the common empty-array reply
+            if body.strip() in (b'', b'[]'):
+                return True, []
+            return True, load_json(body)
         except requests.exceptions.ConnectionError:
             return False, "Connection refused"
         except requests.exceptions.Timeout:
@@ -48,19 +158,37 @@ class ConnectionTester:
         except Exception as e:
             return False, str(e)
     
+    def _read_body(self, response):
+        """Read a streamed response body, refusing anything over MAX_RESPONSE_BYTES"""
+        length = response.headers.get('Content-Length')
+        if length is not None and int(length) > MAX_RESPONSE_BYTES:
+            raise ValueError(f"Response too large ({length} bytes)")
+        
+        body = bytearray()
+        for chunk in response.iter_content(8192):
+            body += chunk
+            if len(body) > MAX_RESPONSE_BYTES:
+                raise ValueError(f"Response larger than {MAX_RESPONSE_BYTES} bytes")
+        return bytes(body)
+    
     def ping_test(self, ip):
         """Test ping connectivity"""
-        try:
-            # Windows ping command
-            result = subprocess.run(['ping', '-n', '2', ip], 
-                                  capture_output=True, text=True, timeout=10)
-            return result.returncode == 0
-        except Exception:
-            return False
+        return self.ping_all([ip])[ip]
+    
+    def ping_all(self, ips):
+        """Ping several IPs in one batch, returning {ip: reachable}"""
+        return asyncio.run(self._ping_all(ips))
     
     def check_bluetooth_status(self):
         """Check if Bluetooth service is running"""
         try:
+            # Ask the Service Control Manager in-process when a binding is available
+            if win32serviceutil is not None:
+                status = win32serviceutil.QueryServiceStatus('bthserv')
+                return status[1] == win32service.SERVICE_RUNNING
+            if psutil is not None and hasattr(psutil, 'win_service_get'):
+                return psutil.win_service_get('bthserv').status() == 'running'
+            
             result = subprocess.run(['sc', 'query', 'bthserv'], 
                                   capture_output=True, text=True)
             return 'RUNNING' in result.stdout
@@ -71,24 +199,80 @@ class ConnectionTester:
         """Get network interface information"""
         interfaces = []
         try:
-            result = subprocess.run(['ipconfig', '/all'], 
-                                  capture_output=True, text=True)
+            if psutil is not None:
+                for name, addrs in psutil.net_if_addrs().items():
+                    for addr in addrs:
+                        if addr.family == socket.AF_INET and addr.address.startswith('192.168.'):
+                            interfaces.append({'name': name, 'ip': addr.address})
+                return interfaces
             
-            current_interface = None
-            for line in result.stdout.split('\n'):
-                line = line.strip()
-                if line and not line.startswith(' ') and ':' in line:
-                    current_interface = line
-                elif 'IPv4' in line and '192.168.' in line:
-                    if current_interface:
-                        interfaces.append({
-                            'name': current_interface,
-                            'ip': line.split(':')[-1].strip()
-                        })
+            # Parse ipconfig output as it streams rather than buffering it all
+            with subprocess.Popen(['ipconfig', '/all'], stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL, text=True) as proc:
+                current_interface = None
+                for raw_line in proc.stdout:
+                    line = raw_line.strip()
+                    # Adapter headers are flush left; their properties are indented
+                    if line and not raw_line.startswith(' ') and ':' in line:
+                        current_interface = line
+                    elif 'IPv4' in line and '192.168.' in line:
+                        if current_interface:
+                            interfaces.append({
+                                'name': current_interface,
+                                'ip': line.split(':')[-1].strip()
+                            })
         except Exception:
             pass
         return interfaces
     
+    async def _ping_all(self, ips):
+        """Send one echo to every IP concurrently"""
+        if icmplib is not None:
+            try:
+                hosts = await icmplib.async_multiping(ips, count=1, timeout=1, privileged=False)
+                return {host.address: host.is_alive for host in hosts}
+            except Exception:
+                pass  # Unprivileged ICMP not permitted - fall back to ping.exe
+        
+        results = await asyncio.gather(*[self._ping_async(ip) for ip in ips])
+        return dict(zip(ips, results))
+    
+    async def _ping_async(self, ip):
+        """Ping without blocking the event loop"""
+        try:
+            # Windows ping command: one echo, 1s reply timeout
+            proc = await asyncio.create_subprocess_exec(
+                'ping', '-n', '1', '-w', '1000', ip,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            try:
+                await asyncio.wait_for(proc.communicate(), timeout=5)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                return False
+            return proc.returncode == 0
+        except Exception:
+            return False
+    
+    async def _run_all(self):
+        """Probe all Bluetooth PAN IPs and localhost concurrently"""
+        ips = self.bluetooth_ips + ['127.0.0.1']
+        loop = asyncio.get_running_loop()
+        
+        # Blocking probes (selector fan-out, requests) get one worker per target
+        with ThreadPoolExecutor(max_workers=len(ips)) as executor:
+            pings, sockets = await asyncio.gather(
+                self._ping_all(self.bluetooth_ips),
+                loop.run_in_executor(executor, self.test_socket_connection_many, ips))
+            
+            open_ips = [ip for ip in ips if sockets[ip]]
+            xdrip = await asyncio.gather(
+                *[loop.run_in_executor(executor, self.test_xdrip_service, ip) for ip in open_ips])
+            xdrip = dict(zip(open_ips, xdrip))
+        
+        return [{'ip': ip, 'ping': pings.get(ip), 'socket': sockets[ip], 'xdrip': xdrip.get(ip)}
+                for ip in ips]
+    
     def run_comprehensive_test(self):
         """Run comprehensive connection tests"""
         print("KarooGlucometer Connection Tester")
@@ -112,23 +296,19 @@ class ConnectionTester:
         if not bluetooth_found:
             print("   [INFO] No obvious Bluetooth PAN interfaces found")
         
-        # 3. Test common Bluetooth PAN IPs
+        # 3. Test common Bluetooth PAN IPs (probed concurrently with localhost)
         print(f"\n3. Testing Bluetooth PAN IP addresses:")
+        *pan_results, localhost = asyncio.run(self._run_all())
         working_ip = None
-        for ip in self.bluetooth_ips:
+        for result in pan_results:
+            ip = result['ip']
             print(f"   Testing {ip}...")
-            
-            # Ping test
-            ping_ok = self.ping_test(ip)
-            print(f"      Ping: {'OK' if ping_ok else 'FAIL'}")
-            
-            # Socket test
-            socket_ok = self.test_socket_connection(ip)
-            print(f"      Socket: {'OK' if socket_ok else 'FAIL'}")
+            print(f"      Ping: {'OK' if result['ping'] else 'FAIL'}")
+            print(f"      Socket: {'OK' if result['socket'] else 'FAIL'}")
             
             # xDrip service test
-            if socket_ok:
-                xdrip_ok, xdrip_data = self.test_xdrip_service(ip)
+            if result['socket']:
+                xdrip_ok, xdrip_data = result['xdrip']
                 print(f"      xDrip: {'OK' if xdrip_ok else 'FAIL'}")
                 if xdrip_ok:
                     if isinstance(xdrip_data, list) and len(xdrip_data) > 0:
@@ -141,10 +321,9 @@ class ConnectionTester:
         
         # 4. Test localhost for emulator testing
         print(f"\n4. Testing localhost (emulator mode):")
-        localhost_socket = self.test_socket_connection('127.0.0.1')
-        print(f"   Socket to 127.0.0.1:{self.port}: {'OK' if localhost_socket else 'FAIL'}")
-        if localhost_socket:
-            localhost_xdrip, data = self.test_xdrip_service('127.0.0.1')
+        print(f"   Socket to 127.0.0.1:{self.port}: {'OK' if localhost['socket'] else 'FAIL'}")
+        if localhost['socket']:
+            localhost_xdrip, data = localhost['xdrip']
             print(f"   xDrip service: {'OK' if localhost_xdrip else 'FAIL'}")
             if not working_ip and localhost_xdrip:
                 working_ip = '127.0.0.1'
@@ -191,13 +370,13 @@ def main():
     
     args = parser.parse_args()
     
-    tester = ConnectionTester()
-    tester.port = args.port
-    
-    if args.quick:
-        tester.quick_test(args.quick)
-    else:
-        tester.run_comprehensive_test()
+    with ConnectionTester() as tester:
+        tester.port = args.port
+        
+        if args.quick:
+            tester.quick_test(args.quick)
+        else:
+            tester.run_comprehensive_test()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -8,9 +8,26 @@ import re
 import json
 from pathlib import Path
 
+try:
+    import tomllib  # Python 3.11+
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
 class DependencyAnalyzer:
     """Analyze Android project dependencies for issues"""
     
+    _TARGET_SDK_RE = re.compile(rb'targetSdk\s*=\s*(\d+)')
+    _COMPILE_SDK_RE = re.compile(rb'compileSdk\s*=\s*(\d+)')
+    _EXPLICIT_COMPOSE_RE = re.compile(rb'androidx\.compose\..*:\d+\.\d+\.\d+')
+    _DEPRECATED_PATTERNS = [
+        (re.compile(rb'androidx\.compose\.material:'), 'Consider migrating to Material 3'),
+        (re.compile(rb'androidx\.navigation:navigation-compose:\d+\.\d+\.\d+'), 'Use version catalog instead'),
+        (re.compile(rb'implementation\s*\(\s*"[^"]*"\s*\)'), 'Consider using version catalog'),
+    ]
+    
     def __init__(self, project_path=None):
         self.project_path = Path(project_path) if project_path else Path.cwd()
         self.issues = []
@@ -43,7 +60,7 @@ class DependencyAnalyzer:
             return
             
         try:
-            content = toml_path.read_text(encoding='utf-8')
+            content = toml_path.read_bytes()
             
             # Check version patterns
             self.check_version_patterns(content)
@@ -60,25 +77,14 @@ class DependencyAnalyzer:
     def check_version_patterns(self, content):
         """Check for problematic version patterns"""
         
-        # Extract versions
-        versions = {}
-        version_section = False
-        
-        for line in content.split('\n'):
-            line = line.strip()
-            
-            if line == '[versions]':
-                version_section = True
-                continue
-            elif line.startswith('[') and line != '[versions]':
-                version_section = False
-                continue
-                
-            if version_section and '=' in line:
-                key, value = line.split('=', 1)
-                key = key.strip()
-                value = value.strip().strip('"')
-                versions[key] = value
+        # Extract versions (rich declarations like { strictly = ... } are skipped)
+        text = content.decode('utf-8')
+        if tomllib is None:
+            versions = self.scan_versions_section(text)
+        else:
+            catalog = tomllib.loads(text)
+            versions = {key: value for key, value in catalog.get('versions', {}).items()
+                        if isinstance(value, str)}
         
         # Check for potential issues
         if 'agp' in versions:
@@ -102,22 +108,45 @@ class DependencyAnalyzer:
         # Check for version conflicts
         self.versions = versions
     
+    def scan_versions_section(self, text):
+        """Line-based [versions] scan for Pythons without a TOML parser"""
+        versions = {}
+        version_section = False
+        
+        for line in text.split('\n'):
+            line = line.strip()
+            
+            if line == '[versions]':
+                version_section = True
+                continue
+            elif line.startswith('['):
+                version_section = False
+                continue
+                
+            if version_section and '=' in line:
+                key, value = line.split('=', 1)
+                key = key.strip()
+                value = value.strip().strip('"')
+                versions[key] = value
+        
+        return versions
+    
     def check_compose_compatibility(self, content):
         """Check Compose version compatibility"""
         
         # Check for BOM usage
-        if 'compose-bom' not in content:
+        if b'compose-bom' not in content:
             self.issues.append("Not using Compose BOM - may lead to version conflicts")
             self.suggestions.append("Add Compose BOM to ensure compatible versions")
         
         # Check for explicit Compose versions
-        if re.search(r'androidx\.compose\..*:\d+\.\d+\.\d+', content):
+        if self._EXPLICIT_COMPOSE_RE.search(content):
             self.warnings.append("Explicit Compose versions found - BOM should handle versioning")
             
     def check_room_kotlin_compatibility(self, content):
         """Check Room and Kotlin compatibility"""
         
-        if 'room' in content and 'kotlin' in content:
+        if b'room' in content and b'kotlin' in content:
             # Room 2.8+ requires specific Kotlin versions
             if hasattr(self, 'versions'):
                 room_version = self.versions.get('room', '')
@@ -135,16 +164,16 @@ class DependencyAnalyzer:
             return
             
         try:
-            content = build_gradle_path.read_text(encoding='utf-8')
+            content = build_gradle_path.read_bytes()
             
             # Check for KAPT usage with Room
-            if 'kapt' in content and 'room' in content:
+            if b'kapt' in content and b'room' in content:
                 print("✓ Using KAPT for Room annotation processing")
-            elif 'room' in content and 'kapt' not in content:
+            elif b'room' in content and b'kapt' not in content:
                 self.warnings.append("Room requires KAPT for annotation processing")
                 
             # Check target SDK
-            target_sdk_match = re.search(r'targetSdk\s*=\s*(\d+)', content)
+            target_sdk_match = self._TARGET_SDK_RE.search(content)
             if target_sdk_match:
                 target_sdk = int(target_sdk_match.group(1))
                 if target_sdk >= 34:
@@ -153,7 +182,7 @@ class DependencyAnalyzer:
                     self.warnings.append(f"Target SDK {target_sdk} is outdated")
             
             # Check compile SDK
-            compile_sdk_match = re.search(r'compileSdk\s*=\s*(\d+)', content)
+            compile_sdk_match = self._COMPILE_SDK_RE.search(content)
             if compile_sdk_match:
                 compile_sdk = int(compile_sdk_match.group(1))
                 if compile_sdk >= 34:
@@ -168,14 +197,8 @@ class DependencyAnalyzer:
     def check_deprecated_dependencies(self, content):
         """Check for deprecated dependencies"""
         
-        deprecated_patterns = [
-            (r'androidx\.compose\.material:', 'Consider migrating to Material 3'),
-            (r'androidx\.navigation:navigation-compose:\d+\.\d+\.\d+', 'Use version catalog instead'),
-            (r'implementation\s*\(\s*"[^"]*"\s*\)', 'Consider using version catalog'),
-        ]
-        
-        for pattern, message in deprecated_patterns:
-            if re.search(pattern, content):
+        for pattern, message in self._DEPRECATED_PATTERNS:
+            if pattern.search(content):
                 self.suggestions.append(message)
     
     def check_known_issues(self):
@@ -4,76 +4,182 @@ KarooGlucometer Testing Suite - Consolidated Test Server
 Single mock server for all testing scenarios
 """
 
+import heapq
+import io
+import itertools
 import json
+import logging
+import os
+import socket
 import time
 import random
 import threading
 import argparse
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import email.utils
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = 'application/json'
+JSON_SEPARATORS = (',', ':')
+EMPTY_PAYLOAD = b'[]'
+EMPTY_ETAG = 'W/"empty"'
+READING_BUCKET = 60  # Seconds each generated set of readings (and its ETag) stays current
+SLOW_RESPONSE_DELAY = 5  # Seconds 'slow' mode holds back each glucose reply
+READING_INTERVAL = timedelta(minutes=5)  # CGM sample spacing
+
+# Canned reply for connections turned away while every handler slot is busy
+BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                 b'Content-Type: text/plain\r\n'
+                 b'Content-Length: 4\r\n'
+                 b'Retry-After: 1\r\n'
+                 b'Connection: close\r\n'
+                 b'\r\n'
+                 b'Busy')
+
+DIRECTIONS = {
+    1: "DoubleUp", 2: "SingleUp", 3: "FortyFiveUp",
+    4: "Flat", 5: "FortyFiveDown", 6: "SingleDown", 7: "DoubleDown"
+}
+TREND_POPULATION = (3, 4, 5)
+TREND_WEIGHTS = (1, 3, 1)  # Mostly flat
+
+try:
+    import orjson
+    dump_json = orjson.dumps  # Compact output, already bytes
+except ImportError:
+    # json.dumps builds a fresh encoder whenever options are passed; reuse one
+    _json_encoder = json.JSONEncoder(separators=JSON_SEPARATORS)
+    
+    def dump_json(obj):
+        """Serialize obj to compact UTF-8 JSON bytes"""
+        return _json_encoder.encode(obj).encode('utf-8')
+
+# (epoch second, HTTP Date value) - replaced as one tuple so threads never see a torn pair
+_http_date = (0, '')
+
+def http_date():
+    """Current time as an HTTP Date header value, formatted at most once per second"""
+    global _http_date
+    now = int(time.time())
+    second, value = _http_date
+    if now != second:
+        value = email.utils.formatdate(now, usegmt=True)
+        _http_date = (now, value)
+    return value
 
 class MockXDripHandler(BaseHTTPRequestHandler):
     """HTTP request handler that simulates xDrip responses"""
     
+    # Keep-alive: every response carries Content-Length, so clients can reuse the connection
+    protocol_version = "HTTP/1.1"
+    timeout = 15  # Seconds an idle keep-alive connection may hold a handler thread
+    
+    # Buffer writes so each response's headers and body leave in one send()
+    wbufsize = 8192
+    
+    # Path -> handler method name
+    _ROUTES = {
+        '/sgv.json': 'send_glucose_data',
+        '/status.json': 'send_status',
+        '/status': 'send_status',
+        '/fail': 'send_server_error',
+    }
+    
     def __init__(self, *args, server_mode="normal", **kwargs):
         self.server_mode = server_mode
         super().__init__(*args, **kwargs)
     
     def do_GET(self):
         """Handle GET requests"""
-        if self.path == '/sgv.json':
-            self.send_glucose_data()
-        elif self.path == '/status.json':
-            self.send_status()
-        elif self.path == '/fail':
-            self.send_error()
+        handler = self._ROUTES.get(self.path)
+        if handler:
+            getattr(self, handler)()
         else:
             self.send_404()
     
     def send_glucose_data(self):
         """Send mock glucose data based on server mode"""
         if self.server.server_mode == "error":
-            self.send_error()
+            self.send_server_error()
             return
-        elif self.server.server_mode == "slow":
-            time.sleep(5)  # Simulate slow response
-        elif self.server.server_mode == "empty":
-            glucose_data = []
+        
+        if self.server.server_mode == "empty":
+            response, num_readings, etag = EMPTY_PAYLOAD, 0, EMPTY_ETAG
         else:
-            # Generate realistic glucose readings
-            glucose_data = []
-            num_readings = 1 if self.server.server_mode == "single" else 3
-            
-            for i in range(num_readings):
-                base_time = int(time.time() * 1000) - (i * 300000)  # 5 min intervals
-                glucose_value = random.randint(80, 180)
-                trend = random.choice([3, 4, 4, 4, 5])  # Mostly flat
-                
-                directions = {
-                    1: "DoubleUp", 2: "SingleUp", 3: "FortyFiveUp",
-                    4: "Flat", 5: "FortyFiveDown", 6: "SingleDown", 7: "DoubleDown"
-                }
-                
-                reading = {
-                    "_id": f"test_{base_time}_{i}",
-                    "sgv": glucose_value,
-                    "date": base_time,
-                    "dateString": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(base_time/1000)),
-                    "trend": trend,
-                    "direction": directions[trend],
-                    "device": "MockSensor",
-                    "type": "sgv"
-                }
-                glucose_data.append(reading)
+            response, num_readings, etag = self.get_glucose_payload()
         
-        response = json.dumps(glucose_data, indent=2)
+        # Pollers that already hold this payload get a bodiless 304
+        status = 200
+        if self.etag_matches(etag):
+            status, response = 304, None
+        max_age = READING_BUCKET - int(time.time()) % READING_BUCKET  # Until the next bucket
+        headers = (('ETag', etag), ('Cache-Control', f'max-age={max_age}'))
         
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(response.encode('utf-8'))
+        if self.server.server_mode == "slow":
+            self.send_body_later(SLOW_RESPONSE_DELAY, status, response, headers=headers)  # Simulate slow response
+        else:
+            self.send_body(status, response, headers=headers)
+        
+        if status == 304:
+            log.info("Glucose data not modified")
+        else:
+            log.info("Served glucose data (%d readings)", num_readings)
+    
+    def etag_matches(self, etag):
+        """True if the request's If-None-Match covers etag (weak comparison)"""
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        tags = {self.opaque_tag(tag.strip()) for tag in header.split(',')}
+        return '*' in tags or self.opaque_tag(etag) in tags
+    
+    @staticmethod
+    def opaque_tag(tag):
+        """Strip the weak W/ prefix from an entity tag"""
+        return tag[2:] if tag.startswith('W/') else tag
+    
+    def get_glucose_payload(self):
+        """Return (encoded payload, reading count, ETag), regenerated once per READING_BUCKET"""
+        server = self.server
+        with server.payload_lock:
+            bucket = int(time.time()) // READING_BUCKET
+            cached_bucket, payload, num_readings, etag = server.payload_cache
+            if bucket != cached_bucket:
+                glucose_data = self.generate_readings(bucket * READING_BUCKET)
+                payload = dump_json(glucose_data)
+                num_readings = len(glucose_data)
+                etag = f'W/"{glucose_data[0]["sgv"]}-{bucket}"'  # Latest reading + bucket
+                server.payload_cache = (bucket, payload, num_readings, etag)
+            return payload, num_readings, etag
+    
+    def generate_readings(self, timestamp):
+        """Generate realistic glucose readings, the latest taken at timestamp"""
+        glucose_data = []
+        num_readings = 1 if self.server.server_mode == "single" else 3
+        
+        now = datetime.fromtimestamp(timestamp, timezone.utc)
+        
+        for i in range(num_readings):
+            reading_time = now - i * READING_INTERVAL
+            base_time = int(reading_time.timestamp() * 1000)
+            glucose_value = random.randint(80, 180)
+            trend = random.choices(TREND_POPULATION, TREND_WEIGHTS)[0]
+            
+            reading = {
+                "_id": f"test_{base_time}_{i}",
+                "sgv": glucose_value,
+                "date": base_time,
+                "dateString": reading_time.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "trend": trend,
+                "direction": DIRECTIONS[trend],
+                "device": "MockSensor",
+                "type": "sgv"
+            }
+            glucose_data.append(reading)
         
-        print(f"[{time.strftime('%H:%M:%S')}] Served glucose data ({len(glucose_data)} readings)")
+        return glucose_data
     
     def send_status(self):
         """Send mock status information"""
@@ -84,31 +190,167 @@ class MockXDripHandler(BaseHTTPRequestHandler):
             "mode": self.server.server_mode
         }
         
-        response = json.dumps(status_data, indent=2)
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(response.encode('utf-8'))
+        self.send_body(200, dump_json(status_data))
     
-    def send_error(self):
+    def send_server_error(self):
         """Send error response"""
-        self.send_response(500)
-        self.send_header('Content-Type', 'text/plain')
-        self.end_headers()
-        self.wfile.write(b'Internal Server Error')
+        self.send_body(500, b'Internal Server Error', 'text/plain')
     
     def send_404(self):
         """Send 404 response"""
-        self.send_response(404)
-        self.send_header('Content-Type', 'text/plain')
+        self.send_body(404, b'Not Found', 'text/plain')
+    
+    def send_body(self, status, body, content_type=JSON_CONTENT_TYPE, close=False, headers=()):
+        """Send a complete response with an encoded body (None for a bodiless 304)"""
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers:
+            self.send_header(name, value)
+        if close:
+            self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(b'Not Found')
+        if body is not None:
+            self.wfile.write(body)
+    
+    def send_body_later(self, delay, status, body, content_type=JSON_CONTENT_TYPE, headers=()):
+        """Hand the response to the server's timer so this thread isn't held for delay seconds"""
+        wfile, self.wfile = self.wfile, io.BytesIO()
+        try:
+            self.send_body(status, body, content_type, close=True, headers=headers)
+            response = self.wfile.getvalue()
+        finally:
+            self.wfile = wfile
+        self.server.send_later(self.connection, response, delay)
+    
+    def date_time_string(self, timestamp=None):
+        """Date header value, shared by every response within the same second"""
+        if timestamp is None:
+            return http_date()
+        return super().date_time_string(timestamp)
     
     def log_message(self, format, *args):
         """Override to provide cleaner logging"""
         pass
 
+class MockHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server tuned for low-latency small responses"""
+    
+    allow_reuse_address = True  # Fast restarts between test runs
+    daemon_threads = True
+    request_queue_size = 128  # Listen backlog, so connection bursts queue instead of being reset
+    max_handler_threads = 64
+    socket_buffer_size = 64 * 1024
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._handler_slots = threading.BoundedSemaphore(self.max_handler_threads)
+        
+        # Delayed replies: heap of (deadline, seq, socket, data) drained by one timer thread
+        self._delayed = []
+        self._delayed_sockets = set()
+        self._delayed_seq = itertools.count()
+        self._delayed_cv = threading.Condition()
+        self._timer_thread = None
+        self._closed = False
+    
+    def process_request(self, request, client_address):
+        """Spawn a handler thread if a slot is free, otherwise answer 503 and close"""
+        # Never wait here: this runs on the serve_forever thread, and busy handlers
+        # would otherwise stall accepting (including /status) and shutdown()
+        if not self._handler_slots.acquire(blocking=False):
+            self.reject_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._handler_slots.release()
+            raise
+    
+    def reject_request(self, request):
+        """Turn a connection away without blocking the accept loop"""
+        try:
+            request.setblocking(False)
+            request.send(BUSY_RESPONSE)  # Fits in a fresh socket's send buffer
+        except OSError:
+            pass
+        self.shutdown_request(request)
+    
+    def process_request_thread(self, request, client_address):
+        """Run the handler, then give its slot back"""
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._handler_slots.release()
+    
+    def server_bind(self):
+        """Size the listener's buffers before binding; accepted sockets inherit them"""
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer_size)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer_size)
+        super().server_bind()
+    
+    def finish_request(self, request, client_address):
+        """Disable Nagle so small JSON responses aren't held back"""
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if hasattr(socket, 'TCP_QUICKACK'):  # Linux only
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        super().finish_request(request, client_address)
+    
+    def send_later(self, request, data, delay):
+        """Write data to request after delay seconds, then close it"""
+        with self._delayed_cv:
+            if self._closed:
+                return  # Not tracked, so the handler's shutdown_request closes it
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._delayed_seq), request, data))
+            self._delayed_sockets.add(request)
+            if self._timer_thread is None:
+                self._timer_thread = threading.Thread(target=self._send_delayed, daemon=True)
+                self._timer_thread.start()
+            self._delayed_cv.notify()
+    
+    def shutdown_request(self, request):
+        """Leave sockets with a pending delayed reply open for the timer thread"""
+        with self._delayed_cv:
+            if request in self._delayed_sockets:
+                return
+        super().shutdown_request(request)
+    
+    def server_close(self):
+        """Stop the timer thread and drop any delayed replies it hasn't sent"""
+        with self._delayed_cv:
+            self._closed = True
+            pending = [request for _, _, request, _ in self._delayed]
+            self._delayed.clear()
+            self._delayed_sockets.clear()
+            self._delayed_cv.notify()
+            timer = self._timer_thread
+        
+        for request in pending:
+            super().shutdown_request(request)
+        if timer is not None:
+            timer.join()
+        super().server_close()
+    
+    def _send_delayed(self):
+        """Timer thread: deliver delayed replies as their deadlines pass"""
+        while True:
+            with self._delayed_cv:
+                while not self._closed and (not self._delayed or self._delayed[0][0] > time.monotonic()):
+                    timeout = self._delayed[0][0] - time.monotonic() if self._delayed else None
+                    self._delayed_cv.wait(timeout)
+                if self._closed:
+                    return
+                _, _, request, data = heapq.heappop(self._delayed)
+                self._delayed_sockets.discard(request)
+            
+            try:
+                request.sendall(data)
+            except OSError:
+                pass  # Client gave up waiting
+            super().shutdown_request(request)
+
 class MockXDripServer:
     """Consolidated mock xDrip server for all testing scenarios"""
     
@@ -127,8 +369,11 @@ class MockXDripServer:
             def handler_factory(*args, **kwargs):
                 return MockXDripHandler(*args, server_mode=self.mode, **kwargs)
             
-            self.server = HTTPServer((self.host, self.port), handler_factory)
+            # Thread per connection so a slow response doesn't stall other clients
+            self.server = MockHTTPServer((self.host, self.port), handler_factory)
             self.server.server_mode = self.mode  # Store mode on server
+            self.server.payload_cache = (None, b'', 0, '')  # (bucket, payload, readings, etag)
+            self.server.payload_lock = threading.Lock()
             
             self.thread = threading.Thread(target=self.server.serve_forever)
             self.thread.daemon = True
@@ -166,6 +411,13 @@ def main():
     
     args = parser.parse_args()
     
+    # Per-request lines are INFO; set LOGLEVEL=WARNING to silence them under load
+    level = (os.environ.get('LOGLEVEL') or 'INFO').upper()
+    if not isinstance(logging.getLevelName(level), int):
+        print(f"Unknown LOGLEVEL '{level}', using INFO")
+        level = 'INFO'
+    logging.basicConfig(level=level, format='[%(asctime)s] %(message)s', datefmt='%H:%M:%S')
+    
     print("Mock xDrip Server for KarooGlucometer Testing")
     print("=" * 50)
     print(f"Starting server on {args.host}:{args.port} in '{args.mode}' mode")